@@ -0,0 +1,30 @@
+-- Indexes backing the hot cart joins. Run against the shop database outside
+-- a transaction block, since CREATE INDEX CONCURRENTLY cannot run inside one.
+
+-- get_cart / checkout: cart items of a cart, in insertion order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cart_items_cart_id_items_id_idx
+  ON cart_items (cart_id, items_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cart_items_sku_idx
+  ON cart_items (sku);
+
+-- search_orders: cart -> global transaction -> gold entry
+CREATE INDEX CONCURRENTLY IF NOT EXISTS carts_global_inventory_transaction_id_idx
+  ON carts (global_inventory_transaction_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS global_inventory_entries_global_inventory_transaction_id_idx
+  ON global_inventory_entries (global_inventory_transaction_id);
+
+-- search_orders default sort (timestamp desc); items_id lives on cart_items,
+-- so the keyset tie-break is covered by the cart_items index above
+CREATE INDEX CONCURRENTLY IF NOT EXISTS global_inventory_transactions_created_at_id_idx
+  ON global_inventory_transactions (created_at DESC, id DESC);
+
+-- potion balances summed per sku
+CREATE INDEX CONCURRENTLY IF NOT EXISTS potion_entries_potion_sku_idx
+  ON potion_entries (potion_sku);
+
+-- search_orders substring filters (ILIKE '%...%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS carts_customer_trgm_idx
+  ON carts USING gin (customer gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cart_items_sku_trgm_idx
+  ON cart_items USING gin (sku gin_trgm_ops);
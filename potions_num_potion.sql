@@ -0,0 +1,50 @@
+-- Running potion balance kept on potions so reads skip summing potion_entries.
+-- potion_entries stays the source of truth: triggers apply every ledger write
+-- to potions.num_potion, and the backfill below rebuilds it from scratch.
+-- Run once with psql before deploying code that reads num_potion.
+
+BEGIN;
+
+-- hold off ledger writes so none land between the backfill and the triggers
+LOCK TABLE potion_entries IN SHARE ROW EXCLUSIVE MODE;
+
+ALTER TABLE potions ADD COLUMN IF NOT EXISTS num_potion int NOT NULL DEFAULT 0;
+
+UPDATE potions
+SET num_potion = COALESCE((
+  SELECT SUM(change)
+  FROM potion_entries
+  WHERE potion_entries.potion_sku = potions.sku
+), 0);
+
+CREATE OR REPLACE FUNCTION apply_potion_entry() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE potions SET num_potion = num_potion - OLD.change WHERE sku = OLD.potion_sku;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE potions SET num_potion = num_potion + NEW.change WHERE sku = NEW.potion_sku;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reset_potion_balances() RETURNS trigger AS $$
+BEGIN
+  UPDATE potions SET num_potion = 0 WHERE num_potion <> 0;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS potion_entries_balance ON potion_entries;
+CREATE TRIGGER potion_entries_balance
+  AFTER INSERT OR UPDATE OF change, potion_sku OR DELETE ON potion_entries
+  FOR EACH ROW EXECUTE FUNCTION apply_potion_entry();
+
+-- TRUNCATE (including admin reset's TRUNCATE ... CASCADE) skips row triggers
+DROP TRIGGER IF EXISTS potion_entries_truncate ON potion_entries;
+CREATE TRIGGER potion_entries_truncate
+  AFTER TRUNCATE ON potion_entries
+  FOR EACH STATEMENT EXECUTE FUNCTION reset_potion_balances();
+
+COMMIT;
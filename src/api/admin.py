@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
-from src.api import auth
+from src.api import auth, catalog
 import sqlalchemy
 from src import database as db
 
@@ -26,6 +26,7 @@ def reset():
         INSERT INTO global_inventory_entries (global_inventory_transaction_id)
         VALUES (:transaction_id)
         """), {"transaction_id": transaction_id})
+  catalog.invalidate_catalog()
   return "OK"
 
 
@@ -83,10 +83,8 @@ def get_wholesale_purchase_plan(wholesale_catalog: list[Barrel]):
         FROM global_inventory_entries
         """)).first()
     potion_inventory = connection.execute(sqlalchemy.text("""
-        SELECT potions.potion_type, COALESCE(SUM(change), 0) as num_potion
+        SELECT potion_type, num_potion
         FROM potions
-        LEFT JOIN potion_entries ON potion_entries.potion_sku = potions.sku                      
-        GROUP BY potions.potion_type
         """)).fetchall()
     current_gold = global_inventory.gold
     current_ml = [global_inventory.num_red_ml, global_inventory.num_green_ml, global_inventory.num_blue_ml, global_inventory.num_dark_ml]
@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends
 from enum import Enum
 from pydantic import BaseModel
-from src.api import auth
+from src.api import auth, catalog, pricing
 import sqlalchemy
 from src import database as db
-from datetime import datetime, timedelta
 import pytz
 
 
@@ -30,20 +29,23 @@ def post_deliver_bottles(potions_delivered: list[PotionInventory]):
   with db.engine.begin() as connection:
     used_ml = [0, 0, 0, 0]
     for potion in potions_delivered:
-      # update potion_inventory
+      for i in range(len(colors)):
+        potion_ml = potion.potion_type[i] * potion.quantity
+        used_ml[i] += potion_ml
+    # update potion_inventory
+    if potions_delivered:
       potion_transaction_id = connection.execute(sqlalchemy.text("""
         INSERT INTO potion_transactions (description)
         VALUES (:description)
         RETURNING id
-        """), {"description": "Bottled: " + str(potion)}).first().id
+        """), {"description": "Bottled: " + str(potions_delivered)}).first().id
+      # executemany is only batched into few round trips by the engine's executemany_mode
       connection.execute(sqlalchemy.text("""
         INSERT INTO potion_entries (potion_sku, change, potion_transaction_id)
         SELECT potions.sku, :change, :transaction_id
         FROM potions WHERE potions.potion_type = :potion_type
-        """), {"change": potion.quantity, "transaction_id": potion_transaction_id, "potion_type": potion.potion_type})
-      for i in range(len(colors)):
-        potion_ml = potion.potion_type[i] * potion.quantity
-        used_ml[i] += potion_ml
+        """), [{"change": potion.quantity, "transaction_id": potion_transaction_id, "potion_type": potion.potion_type}
+               for potion in potions_delivered])
     # update global_inventory
     global_transaction_id = connection.execute(sqlalchemy.text("""
         INSERT INTO global_inventory_transactions (description)
@@ -56,12 +58,10 @@ def post_deliver_bottles(potions_delivered: list[PotionInventory]):
         VALUES (:gold, :num_red_ml, :num_green_ml, :num_blue_ml, :num_dark_ml, :transaction_id)
         """), {"gold": 0, "num_red_ml": -used_ml[0], "num_green_ml": -used_ml[1],
               "num_blue_ml": -used_ml[2], "num_dark_ml": -used_ml[3], "transaction_id": global_transaction_id})
+  catalog.invalidate_catalog()
   return "OK"
 
 
-convert_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-
-
 # Gets called 4 times a day
 @router.post("/plan")
 def get_bottle_plan():
@@ -74,7 +74,7 @@ def get_bottle_plan():
 
   # Initial logic: bottle all barrels into red potions.
   bottling_list = []
-  day = convert_days[(datetime.utcnow()+timedelta(hours=2)).weekday()]
+  day = pricing.pricing_day()
   with db.engine.begin() as connection:
     global_inventory = connection.execute(sqlalchemy.text("""
         SELECT SUM(change_gold) as gold, SUM(change_red_ml) as num_red_ml,
@@ -83,10 +83,8 @@ def get_bottle_plan():
         FROM global_inventory_entries
         """)).first()
     potion_inventory = connection.execute(sqlalchemy.text(f"""
-        SELECT potions.potion_type, COALESCE(SUM(change), 0) as num_potion
+        SELECT potions.potion_type, potions.num_potion
         FROM potions
-        LEFT JOIN potion_entries ON potion_entries.potion_sku = potions.sku                      
-        GROUP BY {day}_sold, potions.potion_type
         ORDER BY {day}_sold DESC, random()
         LIMIT 7
         """)).fetchall()
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, HTTPException, status
 from pydantic import BaseModel
-from src.api import auth
+from src.api import auth, catalog, pricing
 import sqlalchemy
 from src import database as db
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz
 from enum import Enum
+import base64
+import json
 
 router = APIRouter(
   prefix="/carts",
@@ -14,9 +16,6 @@ router = APIRouter(
 )
 
 
-convert_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-
-
 class search_sort_options(str, Enum):
     customer_name = "customer_name"
     item_sku = "item_sku"
@@ -29,6 +28,127 @@ class search_sort_order(str, Enum):
     desc = "desc"   
 
 
+sort_cols = {
+    search_sort_options.customer_name: "carts.customer",
+    search_sort_options.item_sku: "cart_items.sku",
+    search_sort_options.line_item_total: "global_inventory_entries.change_gold",
+    search_sort_options.timestamp: "global_inventory_transactions.created_at",
+}
+
+
+def search_sql(sort_col: search_sort_options, ascending: bool):
+  """Builds the keyset search query for one sort column and direction."""
+  compare = ">" if ascending else "<"
+  order = "ASC" if ascending else "DESC"
+  return sqlalchemy.text(f"""
+      SELECT
+        cart_items.items_id as line_item_id,
+        cart_items.sku as item_sku,
+        carts.customer as customer_name,
+        global_inventory_entries.change_gold as line_item_total,
+        global_inventory_transactions.created_at as timestamp
+      FROM cart_items
+      JOIN carts on cart_items.cart_id = carts.cart_id
+      JOIN global_inventory_transactions on carts.global_inventory_transaction_id = global_inventory_transactions.id
+      JOIN global_inventory_entries on global_inventory_entries.global_inventory_transaction_id = global_inventory_transactions.id
+      WHERE (:customer = '' OR carts.customer ILIKE :customer_like)
+        AND (:sku = '' OR cart_items.sku ILIKE :sku_like)
+        AND (:last_id IS NULL OR ({sort_cols[sort_col]}, cart_items.items_id) {compare} (:last_sort, :last_id))
+      ORDER BY {sort_cols[sort_col]} {order}, cart_items.items_id {order}
+      LIMIT :limit
+      """)
+
+
+# statements are built once here since day, sort column and direction only come from fixed sets
+SEARCH_SQL = {(sort_col, ascending): search_sql(sort_col, ascending)
+              for sort_col in search_sort_options for ascending in (True, False)}
+
+CART_ITEMS_SQL = {day: sqlalchemy.text(f"""
+    SELECT cart_items.sku, cart_items.quantity, potions.{day}_price as price, potions.potion_type,
+           potions.num_potion
+    FROM cart_items
+    JOIN potions ON potions.sku = cart_items.sku
+    WHERE cart_items.cart_id = :cart_id
+    ORDER BY cart_items.items_id
+    """) for day in pricing.convert_days}
+
+CHECKOUT_SQL = {day: sqlalchemy.text(f"""
+    WITH potion_transaction AS (
+        INSERT INTO potion_transactions (description)
+        VALUES (:description)
+        RETURNING id
+    ), entries AS (
+        INSERT INTO potion_entries (potion_sku, change, potion_transaction_id)
+        SELECT cart_items.sku, -cart_items.quantity, t.id
+        FROM cart_items, potion_transaction t
+        WHERE cart_items.cart_id = :cart_id
+        RETURNING potion_sku, change
+    ), totals AS (
+        SELECT COALESCE(SUM(-entries.change), 0) as total_potions_bought,
+               COALESCE(SUM(-entries.change * potions.{day}_price), 0) as total_gold_paid
+        FROM entries
+        JOIN potions ON potions.sku = entries.potion_sku
+    ), global_transaction AS (
+        INSERT INTO global_inventory_transactions (description)
+        VALUES (:description)
+        RETURNING id
+    ), cart AS (
+        UPDATE carts c
+        SET global_inventory_transaction_id = t.id
+        FROM global_transaction t
+        WHERE c.cart_id = :cart_id
+    ), gold AS (
+        INSERT INTO global_inventory_entries (change_gold, global_inventory_transaction_id)
+        SELECT totals.total_gold_paid, t.id
+        FROM totals, global_transaction t
+    )
+    SELECT total_potions_bought, total_gold_paid
+    FROM totals
+    """) for day in pricing.convert_days}
+
+
+def contains_pattern(search: str):
+  """Builds an ILIKE pattern matching search literally anywhere in the value."""
+  escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+  return f"%{escaped}%"
+
+
+def encode_page(direction: str, item, sort_col: search_sort_options):
+  """Builds an opaque keyset cursor from the sort value and id of a row."""
+  sort_value = item[sort_col.value]
+  if isinstance(sort_value, datetime):
+    sort_value = sort_value.isoformat()
+  token = json.dumps([direction, sort_value, item["line_item_id"]])
+  return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def is_int4(value):
+  """Whether value is a plain int that fits a PostgreSQL integer column."""
+  return isinstance(value, int) and not isinstance(value, bool) and -2**31 <= value < 2**31
+
+
+def decode_page(search_page: str, sort_col: search_sort_options):
+  """Returns (direction, last sort value, last line item id) from a cursor."""
+  if search_page == "":
+    return "next", None, None
+  try:
+    direction, sort_value, line_item_id = json.loads(base64.urlsafe_b64decode(search_page.encode()))
+    if sort_col == search_sort_options.line_item_total:
+      valid_sort = is_int4(sort_value)
+    else:
+      valid_sort = isinstance(sort_value, str)
+    if sort_col == search_sort_options.timestamp and valid_sort:
+      sort_value = datetime.fromisoformat(sort_value)
+      valid_sort = sort_value.tzinfo is not None
+  except (ValueError, TypeError):
+    valid_sort = False
+  if not valid_sort or direction not in ("next", "prev") or not is_int4(line_item_id):
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid search page"
+    )
+  return direction, sort_value, line_item_id
+
+
 @router.get("/search/", tags=["search"])
 def search_orders(
     customer_name: str = "",
@@ -61,49 +181,31 @@ def search_orders(
     Your results must be paginated, the max results you can return at any
     time is 5 total line items.
     """
+    direction, last_sort, last_id = decode_page(search_page, sort_col)
+    backwards = direction == "prev"
+    # paging backwards walks the sort in reverse, then flips the page
+    ascending = (sort_order == search_sort_order.asc) != backwards
     with db.engine.begin() as connection:
-      where_message = ""
-      if customer_name != "" and potion_sku != "":
-        where_message = f"WHERE carts.customer ILIKE '%{customer_name}%' AND cart_items.sku ILIKE '%{potion_sku}%'"
-      elif customer_name != "":
-        where_message = f"WHERE carts.customer ILIKE '%{customer_name}%'"
-      elif potion_sku != "":
-        where_message = f"WHERE cart_items.sku ILIKE '%{potion_sku}%'"
-      current = 0 if (search_page == "") else int(search_page)
-      cart_items = connection.execute(sqlalchemy.text(f"""
-          SELECT
-            cart_items.items_id as line_item_id,
-            cart_items.sku as item_sku,
-            carts.customer as customer_name,
-            global_inventory_entries.change_gold as line_item_total,
-            global_inventory_transactions.created_at as timestamp
-          FROM cart_items
-          JOIN carts on cart_items.cart_id = carts.cart_id
-          JOIN global_inventory_transactions on carts.global_inventory_transaction_id = global_inventory_transactions.id
-          JOIN global_inventory_entries on global_inventory_entries.global_inventory_transaction_id = global_inventory_transactions.id
-          {where_message}
-          ORDER BY {sort_col.value} {sort_order.value}
-          LIMIT 6
-          OFFSET {str(current)}
-          """)).fetchall()
-    results = []
-    for item in cart_items:
-      if len(results) < 5:
-        results.append({
-            "line_item_id": item.line_item_id,
-            "item_sku": item.item_sku,
-            "customer_name": item.customer_name,
-            "line_item_total": item.line_item_total,
-            "timestamp": item.timestamp,
-        })
-    previous = current - 5
-    previous = "" if previous < 0 else str(previous)
-    next = current + 5
-    next = "" if len(cart_items) < 6 else str(next) 
+      cart_items = connection.execute(SEARCH_SQL[(sort_col, ascending)],
+          {"customer": customer_name, "customer_like": contains_pattern(customer_name),
+           "sku": potion_sku, "sku_like": contains_pattern(potion_sku),
+           "last_sort": last_sort, "last_id": last_id, "limit": 6}).mappings().all()
+    has_more = len(cart_items) > 5
+    cart_items = cart_items[:5]
+    if backwards:
+      cart_items.reverse()
+    previous = ""
+    next = ""
+    if cart_items:
+      # a page reached going forward always has one before it and vice versa
+      if has_more if backwards else last_id is not None:
+        previous = encode_page("prev", cart_items[0], sort_col)
+      if last_id is not None if backwards else has_more:
+        next = encode_page("next", cart_items[-1], sort_col)
     return {
         "previous": previous,
         "next": next,
-        "results": results
+        "results": cart_items
     }
 
 
@@ -123,12 +225,28 @@ def create_cart(new_cart: NewCart):
   return {"cart_id": cart_id}
 
 
+def format_cart(cart, cart_items, with_stock: bool = True):
+  """Describes a cart and its joined item rows from CART_ITEMS_SQL."""
+  # cart has been checked out
+  if cart.payment:
+    header = f"Cart #{cart.cart_id}: {cart.customer} used {cart.payment} to buy"
+  # cart has not been checked out
+  else:
+    header = f"Cart #{cart.cart_id}: {cart.customer} is seeking to buy"
+  items = [f"{cart_item.quantity} {cart_item.sku} ({cart_item.potion_type}) "
+           f"for {cart_item.quantity * cart_item.price} gold"
+           + (f" ({cart_item.num_potion} remaining)" if with_stock else "")
+           for cart_item in cart_items]
+  if not items:
+    return header + "."
+  return f"{header}: " + ", ".join(items) + "."
+
+
 @router.get("/{cart_id}")
 def get_cart(cart_id: int):
   """ """
+  day = pricing.pricing_day()
   with db.engine.begin() as connection:
-    day = convert_days[(datetime.utcnow()+timedelta(hours=2)).weekday()]
-    message = ""
     cart = connection.execute(sqlalchemy.text("""
         SELECT *
         FROM carts
@@ -136,31 +254,10 @@ def get_cart(cart_id: int):
         """), {"cart_id": cart_id}).first()
     # cart has been created
     if cart:
-      cart_items = connection.execute(sqlalchemy.text("""
-          SELECT *
-          FROM cart_items
-          WHERE cart_id = :cart_id
-          """), {"cart_id": cart_id}).fetchall()
+      cart_items = connection.execute(CART_ITEMS_SQL[day], {"cart_id": cart_id}).fetchall()
       # cart has been set
       if cart_items:
-        # cart has been checked out
-        if cart.payment:
-          message = f"Cart #{cart.cart_id}: {cart.customer} used {cart.payment} to buy:"
-        # cart has not been checked out
-        else:
-          message = f"Cart #{cart.cart_id}: {cart.customer} is seeking to buy:"
-        for cart_item in cart_items:
-          potion = connection.execute(sqlalchemy.text(f"""
-              SELECT potions.{day}_price as price, potions.potion_type, COALESCE(SUM(change), 0) as num_potion
-              FROM potions
-              LEFT JOIN potion_entries ON potion_entries.potion_sku = potions.sku
-              WHERE potions.sku = :sku
-              GROUP BY potions.{day}_price, potions.potion_type
-              """), {"sku": cart_item.sku}).first()
-          message += f" {cart_item.quantity} {cart_item.sku} ({potion.potion_type}) "\
-                     f"for {cart_item.quantity * potion.price} gold "\
-                     f"({potion.num_potion} remaining),"
-        return message[:-1] + "."
+        return format_cart(cart, cart_items)
     # cart has not been created
     else:
       return f"Cart #{cart_id} has not yet been created."
@@ -189,55 +286,18 @@ class CartCheckout(BaseModel):
 @router.post("/{cart_id}/checkout")
 def checkout(cart_id: int, cart_checkout: CartCheckout):
   """ """
+  day = pricing.pricing_day()
   with db.engine.begin() as connection:
-    day = convert_days[(datetime.utcnow()+timedelta(hours=2)).weekday()]
-    total_potions_bought = 0
-    total_gold_paid = 0
-    global_transaction_id = connection.execute(sqlalchemy.text("""
-        WITH transaction AS (
-            INSERT INTO global_inventory_transactions DEFAULT VALUES
-            RETURNING id
-        )
-        UPDATE carts c
-        SET payment = :payment, global_inventory_transaction_id = t.id
-        FROM transaction t
-        WHERE c.cart_id = :cart_id
-        RETURNING t.id
-    """), {"payment": cart_checkout.payment, "cart_id": cart_id}).first().id
-    # get cart
     cart = connection.execute(sqlalchemy.text("""
-        SELECT sku, quantity
-        FROM cart_items
+        UPDATE carts
+        SET payment = :payment
         WHERE cart_id = :cart_id
-        """), {"cart_id": cart_id}).fetchall()
-    for cart_items in cart:
-      potion = connection.execute(sqlalchemy.text("""
-          SELECT *
-          FROM potions
-          WHERE sku = :sku
-          """), {"sku": cart_items.sku}).first()
-      total_potions_bought += cart_items.quantity
-      total_gold_paid += cart_items.quantity * getattr(potion, day + "_price")
-      # update potion_inventory
-      connection.execute(sqlalchemy.text("""
-        WITH transaction AS (
-            INSERT INTO potion_transactions (description)
-            VALUES (:description)
-            RETURNING id
-        )
-        INSERT INTO potion_entries (potion_sku, change, potion_transaction_id)
-        SELECT :potion_sku, :change, t.id
-        FROM transaction t
-          """), {"description": f"sold {cart_items.quantity} {cart_items.sku}", "potion_sku": cart_items.sku, "change": -cart_items.quantity})
-    # update global_inventory
-    connection.execute(sqlalchemy.text("""
-        UPDATE global_inventory_transactions
-        SET description = :description
-        WHERE id = :transaction_id
-        """), {"description": f"sold {cart_items.quantity} {cart_items.sku}", "transaction_id": global_transaction_id})
-    connection.execute(sqlalchemy.text("""
-        INSERT INTO global_inventory_entries (change_gold, global_inventory_transaction_id)
-        VALUES (:total_gold_paid, :transaction_id)
-        """), {"total_gold_paid": total_gold_paid, "transaction_id": global_transaction_id})
-    connection.commit()
-    return {"total_potions_bought": total_potions_bought, "total_gold_paid": total_gold_paid}
+        RETURNING cart_id, customer, payment
+        """), {"payment": cart_checkout.payment, "cart_id": cart_id}).first()
+    cart_items = connection.execute(CART_ITEMS_SQL[day], {"cart_id": cart_id}).fetchall()
+    # stock is read before the sale, so leave it out of the ledger description
+    description = format_cart(cart, cart_items, with_stock=False)
+    # update potion_inventory and global_inventory
+    totals = connection.execute(CHECKOUT_SQL[day], {"description": description, "cart_id": cart_id}).first()
+  catalog.invalidate_catalog()
+  return {"total_potions_bought": totals.total_potions_bought, "total_gold_paid": totals.total_gold_paid}
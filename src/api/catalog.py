@@ -1,14 +1,22 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 import sqlalchemy
 from src import database as db
-from datetime import datetime, timedelta
+from src.api.pricing import pricing_day
 import pytz
+import time
 
 
 router = APIRouter()
 
 
-convert_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# seconds a built catalog is served before the database is read again
+CATALOG_TTL = 2.0
+catalog_cache = {}
+
+
+def invalidate_catalog():
+  """Drops the cached catalog so the next request rereads the database."""
+  catalog_cache.clear()
 
 
 @router.get("/catalog/", tags=["catalog"])
@@ -18,23 +26,26 @@ def get_catalog():
   """
 
   # Can return a max of 20 items.
+  day = pricing_day()
+  cached = catalog_cache.get(day)
+  if cached and time.monotonic() - cached[0] < CATALOG_TTL:
+    return Response(content=cached[1], media_type="application/json")
   with db.engine.begin() as connection:
-    day = convert_days[(datetime.utcnow()+timedelta(hours=2)).weekday()]
-    potion_inventory = connection.execute(sqlalchemy.text(f"""
-        SELECT potions.sku, potions.{day}_price as price, potions.potion_type, COALESCE(SUM(change), 0) as num_potion
-        FROM potions
-        LEFT JOIN potion_entries ON potion_entries.potion_sku = potions.sku                      
-        GROUP BY potions.sku, potions.{day}_price, potions.potion_type
-        ORDER BY {day}_sold DESC, random()
-        """)).fetchall()
-    catalog = []
-    for potion in potion_inventory:
-      if len(catalog) < 6:
-        catalog.append({
-          "sku": potion.sku,
-          "name": potion.sku,
-          "quantity": 30,
-          "price": potion.price,
-          "potion_type": potion.potion_type,
-        })
-  return catalog
+    catalog = connection.execute(sqlalchemy.text(f"""
+        SELECT COALESCE(json_agg(json_build_object(
+          'sku', sku,
+          'name', sku,
+          'quantity', 30,
+          'price', price,
+          'potion_type', potion_type
+        ) ORDER BY num_sold DESC, ordering), '[]')::text as catalog
+        FROM (
+          SELECT potions.sku, potions.{day}_price as price, potions.potion_type,
+                 {day}_sold as num_sold, random() as ordering
+          FROM potions
+          ORDER BY {day}_sold DESC, ordering
+          LIMIT 6
+        ) listed
+        """)).first().catalog
+  catalog_cache[day] = (time.monotonic(), catalog)
+  return Response(content=catalog, media_type="application/json")
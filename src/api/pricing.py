@@ -0,0 +1,11 @@
+import time
+
+
+convert_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# prices roll over to the next day at 22:00 UTC
+DAY_OFFSET = 2 * 60 * 60
+
+
+def pricing_day():
+  """Returns the convert_days name of the day whose prices are in effect."""
+  return convert_days[time.gmtime(time.time() + DAY_OFFSET).tm_wday]
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, exceptions
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import ValidationError
 from src.api import audit, carts, catalog, bottler, barrels, admin
 import json
@@ -20,6 +20,7 @@ app = FastAPI(
         "name": "Lucas Pierce",
         "email": "lupierce@calpoly.edu",
     },
+    default_response_class=ORJSONResponse,
 )
 
 origins = ["https://potion-exchange.vercel.app"]
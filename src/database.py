@@ -2,9 +2,13 @@ import os
 import dotenv
 from sqlalchemy import create_engine
 
+POOL_SIZE = 40
+MAX_OVERFLOW = 10
+
 def database_connection_url():
     dotenv.load_dotenv()
 
     return os.environ.get("POSTGRES_URI")
 
-engine = create_engine(database_connection_url(), pool_pre_ping=True, pool_size=40, max_overflow=10, connect_args={'connect_timeout': 60})
\ No newline at end of file
+engine = create_engine(database_connection_url(), pool_pre_ping=True, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                       pool_recycle=3600, executemany_mode="values_plus_batch", connect_args={'connect_timeout': 60})
\ No newline at end of file